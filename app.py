@@ -1,4 +1,5 @@
 import json
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
 from typing import Dict
 
@@ -9,7 +10,6 @@ import streamlit as st
 
 from src.ahp import (
     SAATY_SCALE,
-    aggregate_pairwise_matrices,
     build_pairwise_matrix,
     consistency_ratio,
     matrix_to_json,
@@ -17,15 +17,28 @@ from src.ahp import (
 )
 from src.data import (
     REQUIRED_COLUMNS,
+    SharedDataset,
     coerce_numeric,
-    dataset_hash,
     demo_dataset,
+    diff_fingerprints,
+    intern_dataset,
     load_dataframe,
+    source_key,
     validate_ranges,
     validate_schema,
 )
-from src.db import fetch_votes, init_db, parse_vote_matrices, save_vote
-from src.scoring import MACRO_CRITERIA, compute_macro_scores, normalize_min_max, rank_alternatives
+from src.consensus import cached_consensus
+from src.db import DB_TIMEOUT, carry_votes, fetch_vote_store, init_db, save_vote, start_prefetch, wait_prefetch
+from src import perf
+from src.scoring import (
+    MACRO_CRITERIA,
+    compute_macro_scores,
+    min_max_bounds,
+    normalize_min_max,
+    rank_alternatives,
+    update_macro_scores,
+    update_min_max_bounds,
+)
 
 import plotly.graph_objects as go
 
@@ -41,21 +54,63 @@ DB_PATH = os.getenv("AHP_DB_PATH", "data/ahp.db")
 def init_state():
     if "dataset" not in st.session_state:
         st.session_state.dataset = None
+    if "shared_dataset" not in st.session_state:
+        st.session_state.shared_dataset = None
     if "dataset_hash" not in st.session_state:
         st.session_state.dataset_hash = None
+    if "previous_dataset_hash" not in st.session_state:
+        st.session_state.previous_dataset_hash = None
+    if "fingerprints" not in st.session_state:
+        st.session_state.fingerprints = None
+    if "macro_scores" not in st.session_state:
+        st.session_state.macro_scores = None
+    if "macro_bounds" not in st.session_state:
+        st.session_state.macro_bounds = None
+
+
+def set_dataset(shared: SharedDataset):
+    if shared is st.session_state.shared_dataset:
+        return
+    df = shared.df
+    new_hash = shared.hash
+    fingerprints = None
+    macro_scores = None
+    bounds = None
+    if validate_schema(df)[0]:
+        fingerprints = shared.fingerprints
+        previous = st.session_state.fingerprints
+        old_macro = st.session_state.macro_scores
+        if previous is None or old_macro is None:
+            macro_scores = compute_macro_scores(df)
+            bounds = min_max_bounds(macro_scores)
+        else:
+            changed, removed = diff_fingerprints(previous, fingerprints)
+            macro_scores = update_macro_scores(old_macro, df, changed, removed)
+            bounds = update_min_max_bounds(
+                st.session_state.macro_bounds,
+                old_macro[old_macro.index.isin(changed + removed)],
+                macro_scores[macro_scores.index.isin(changed)],
+                macro_scores,
+            )
+    if new_hash != st.session_state.dataset_hash:
+        st.session_state.previous_dataset_hash = st.session_state.dataset_hash
+    st.session_state.shared_dataset = shared
+    st.session_state.dataset = df
+    st.session_state.dataset_hash = new_hash
+    st.session_state.fingerprints = fingerprints
+    st.session_state.macro_scores = macro_scores
+    st.session_state.macro_bounds = bounds
 
 
 def load_demo():
-    df = demo_dataset()
-    st.session_state.dataset = df
-    st.session_state.dataset_hash = dataset_hash(df)
+    set_dataset(intern_dataset("demo", demo_dataset))
 
 
 def load_upload(file):
-    df = load_dataframe(file)
-    df = coerce_numeric(df)
-    st.session_state.dataset = df
-    st.session_state.dataset_hash = dataset_hash(df)
+    def loader():
+        return coerce_numeric(load_dataframe(file))
+
+    set_dataset(intern_dataset(source_key(file.getvalue()), loader))
 
 
 def data_setup_section():
@@ -87,6 +142,18 @@ def data_setup_section():
 
     st.success("Schema valido.")
 
+    previous_hash = st.session_state.previous_dataset_hash
+    if previous_hash and previous_hash != st.session_state.dataset_hash:
+        st.caption(f"Versione precedente del dataset: {previous_hash}")
+        if st.button("Trasferisci voti dalla versione precedente"):
+            try:
+                init_db()
+                carried = carry_votes(previous_hash, st.session_state.dataset_hash)
+            except Exception as exc:
+                st.error(f"DB non raggiungibile: {exc}")
+                return
+            st.success(f"Voti trasferiti: {carried}")
+
 
 def vote_section():
     st.header("Vota")
@@ -156,25 +223,27 @@ def vote_section():
     if cr >= 0.10:
         st.warning("CR >= 0.10. Rivedi i confronti per maggiore coerenza.")
 
-    if st.button("Invia voto"):
+    if st.button("Invia voto", key="invia_voto"):
+        weights_json = json.dumps({criteria[i]: float(weights[i]) for i in range(len(criteria))})
         try:
             init_db()
+            save_vote(
+                user_name=user_name,
+                dataset_hash=st.session_state.dataset_hash,
+                pairwise_matrix_json=matrix_to_json(matrix),
+                weights_json=weights_json,
+                cr=float(cr),
+                created_at=datetime.utcnow().isoformat(),
+            )
         except Exception as exc:
             st.error(f"DB non raggiungibile: {exc}")
-            return
-        weights_json = json.dumps({criteria[i]: float(weights[i]) for i in range(len(criteria))})
-        save_vote(
-            user_name=user_name,
-            dataset_hash=st.session_state.dataset_hash,
-            pairwise_matrix_json=matrix_to_json(matrix),
-            weights_json=weights_json,
-            cr=float(cr),
-            created_at=datetime.utcnow().isoformat(),
-        )
+            return False
         st.success("Voto salvato.")
+        return True
+    return False
 
 
-def results_section():
+def results_section(prefetch=None):
     st.header("Risultati")
 
     if st.session_state.dataset is None:
@@ -186,12 +255,18 @@ def results_section():
         return
 
     try:
-        init_db()
-        rows = fetch_votes(st.session_state.dataset_hash)
+        if prefetch is not None:
+            votes = wait_prefetch(prefetch)
+        else:
+            init_db()
+            votes = fetch_vote_store(st.session_state.dataset_hash, MACRO_CRITERIA)
+    except FutureTimeout:
+        st.error(f"DB non raggiungibile: nessuna risposta entro {DB_TIMEOUT:g} s")
+        return
     except Exception as exc:
         st.error(f"DB non raggiungibile: {exc}")
         return
-    st.write(f"Numero voti: {len(rows)}")
+    st.write(f"Numero voti: {len(votes)}")
 
     if st_autorefresh is not None:
         auto = st.checkbox("Auto-refresh (10s)")
@@ -201,9 +276,8 @@ def results_section():
     if st.button("Aggiorna"):
         st.experimental_rerun()
 
-    if rows:
-        matrices = parse_vote_matrices(rows)
-        group_matrix = aggregate_pairwise_matrices(matrices)
+    if len(votes):
+        group_matrix = votes.group_matrix()
         group_weights = weights_geometric_mean(group_matrix)
         group_cr = consistency_ratio(group_matrix, group_weights)
     else:
@@ -214,8 +288,29 @@ def results_section():
     st.write({MACRO_CRITERIA[i]: round(float(group_weights[i]), 4) for i in range(3)})
     st.write(f"CR gruppo: {group_cr:.4f}")
 
+    if len(votes):
+        st.subheader("Consenso del gruppo")
+        n_clusters = 3 if st.checkbox("Raggruppa i votanti per pesi") else 0
+        report = cached_consensus(st.session_state.dataset_hash, votes, n_clusters=n_clusters)
+        st.write(f"Indice di consenso: {report['consensus_index']:.4f}")
+        voters = pd.DataFrame(
+            {
+                "Votante": votes.users,
+                "Distanza dal gruppo": report["distances"],
+                "Outlier": report["outliers"],
+            }
+        )
+        if n_clusters:
+            voters["Gruppo"] = report["cluster_labels"]
+        n_outliers = int(report["outliers"].sum())
+        if n_outliers:
+            st.warning(f"Votanti anomali: {n_outliers}")
+        st.dataframe(voters.sort_values("Distanza dal gruppo", ascending=False))
+
     weights_dict = {MACRO_CRITERIA[i]: float(group_weights[i]) for i in range(3)}
-    ranking = rank_alternatives(st.session_state.dataset, weights_dict)
+    macro_scores = st.session_state.macro_scores
+    bounds = st.session_state.macro_bounds
+    ranking = rank_alternatives(st.session_state.dataset, weights_dict, macro_scores, bounds)
 
     if ranking.empty:
         st.warning("Nessun locale con dati completi per il ranking.")
@@ -226,27 +321,28 @@ def results_section():
     st.success(f"Raccomandato: {ranking.iloc[0]['LOCALI']}")
 
     top = ranking.head(5).copy()
-    fig_bar = go.Figure()
-    fig_bar.add_trace(go.Bar(x=top["LOCALI"], y=top["score"], marker_color="#1f77b4"))
-    fig_bar.update_layout(title="Top 5 - Punteggio", xaxis_title="Locale", yaxis_title="Score")
-    st.plotly_chart(fig_bar, use_container_width=True)
-
-    macro_scores = compute_macro_scores(st.session_state.dataset)
-    macro_norm = normalize_min_max(macro_scores)
-    radar = go.Figure()
-    for locale in top["LOCALI"]:
-        if locale not in macro_norm.index:
-            continue
-        radar.add_trace(
-            go.Scatterpolar(
-                r=[macro_norm.loc[locale, c] for c in MACRO_CRITERIA],
-                theta=MACRO_CRITERIA,
-                fill="toself",
-                name=str(locale),
+    with perf.span("app.plotly.bar"):
+        fig_bar = go.Figure()
+        fig_bar.add_trace(go.Bar(x=top["LOCALI"], y=top["score"], marker_color="#1f77b4"))
+        fig_bar.update_layout(title="Top 5 - Punteggio", xaxis_title="Locale", yaxis_title="Score")
+        st.plotly_chart(fig_bar, use_container_width=True)
+
+    macro_norm = normalize_min_max(macro_scores, bounds)
+    with perf.span("app.plotly.radar"):
+        radar = go.Figure()
+        for locale in top["LOCALI"]:
+            if locale not in macro_norm.index:
+                continue
+            radar.add_trace(
+                go.Scatterpolar(
+                    r=[macro_norm.loc[locale, c] for c in MACRO_CRITERIA],
+                    theta=MACRO_CRITERIA,
+                    fill="toself",
+                    name=str(locale),
+                )
             )
-        )
-    radar.update_layout(title="Radar - Macro-criteri (Top 5)", polar=dict(radialaxis=dict(visible=True)))
-    st.plotly_chart(radar, use_container_width=True)
+        radar.update_layout(title="Radar - Macro-criteri (Top 5)", polar=dict(radialaxis=dict(visible=True)))
+        st.plotly_chart(radar, use_container_width=True)
 
     st.subheader("Dettaglio macro e sotto-criteri (Top 5)")
     detail = st.session_state.dataset.copy()
@@ -255,16 +351,50 @@ def results_section():
     st.dataframe(detail.loc[top["LOCALI"]])
 
 
+def perf_panel():
+    records = perf.rerun_records()
+    with st.sidebar.expander("Prestazioni (ultimo rerun)", expanded=True):
+        if not records:
+            st.caption("Nessuna misura registrata.")
+            return
+        breakdown = pd.DataFrame(records)
+        breakdown["span"] = ["  " * d + name for d, name in zip(breakdown["depth"], breakdown["span"])]
+        breakdown["ms"] = (pd.to_numeric(breakdown["seconds"]) * 1000).round(2)
+        breakdown["Δ RSS MiB"] = (pd.to_numeric(breakdown["rss_delta_bytes"]) / 2**20).round(2)
+        st.dataframe(breakdown[["span", "ms", "Δ RSS MiB", "error"]], hide_index=True)
+        memory = perf.process_memory()
+        st.caption(f"Picco memoria processo: {memory['peak_rss_bytes'] / 2**20:.1f} MiB")
+        st.download_button("Esporta JSON lines", perf.export_jsonl(), file_name="ahp_perf.jsonl")
+        st.download_button("Esporta Prometheus", perf.export_prometheus(), file_name="ahp_perf.prom")
+
+
 def main():
     st.set_page_config(page_title="AHPadvisor", layout="wide")
     st.title("AHPadvisor")
 
+    debug = st.sidebar.checkbox("Debug prestazioni", value=perf.ENABLED_BY_DEFAULT)
+    perf.start_rerun(enabled=debug)
+
     init_state()
-    data_setup_section()
+    with perf.span("app.data_setup_section"):
+        data_setup_section()
+
+    # Votes load in the background while the vote form renders, except on the rerun that
+    # submits a vote: the prefetched votes would be stale once it is saved
+    prefetch = None
+    voting = st.session_state.get("invia_voto", False)
+    if not voting and st.session_state.dataset is not None and validate_schema(st.session_state.dataset)[0]:
+        prefetch = start_prefetch(st.session_state.dataset_hash, MACRO_CRITERIA)
+
     st.divider()
-    vote_section()
+    with perf.span("app.vote_section"):
+        saved = vote_section()
     st.divider()
-    results_section()
+    with perf.span("app.results_section"):
+        results_section(None if saved else prefetch)
+
+    if debug:
+        perf_panel()
 
 
 if __name__ == "__main__":
@@ -3,11 +3,14 @@ from typing import Dict, List, Tuple
 
 import numpy as np
 
+from .perf import timed
+
 
 SAATY_SCALE = [1, 3, 5, 7, 9]
 RI_TABLE = {1: 0.0, 2: 0.0, 3: 0.58, 4: 0.9, 5: 1.12, 6: 1.24, 7: 1.32, 8: 1.41, 9: 1.45, 10: 1.49}
 
 
+@timed
 def build_pairwise_matrix(criteria: List[str], comparisons: Dict[Tuple[str, str], float]) -> np.ndarray:
     n = len(criteria)
     idx = {c: i for i, c in enumerate(criteria)}
@@ -20,6 +23,7 @@ def build_pairwise_matrix(criteria: List[str], comparisons: Dict[Tuple[str, str]
     return mat
 
 
+@timed
 def weights_geometric_mean(matrix: np.ndarray) -> np.ndarray:
     if matrix.shape[0] != matrix.shape[1]:
         raise ValueError("Pairwise matrix must be square")
@@ -28,6 +32,7 @@ def weights_geometric_mean(matrix: np.ndarray) -> np.ndarray:
     return weights
 
 
+@timed
 def consistency_ratio(matrix: np.ndarray, weights: np.ndarray) -> float:
     n = matrix.shape[0]
     if n <= 2:
@@ -41,6 +46,7 @@ def consistency_ratio(matrix: np.ndarray, weights: np.ndarray) -> float:
     return ci / ri
 
 
+@timed
 def aggregate_pairwise_matrices(matrices: List[np.ndarray]) -> np.ndarray:
     if not matrices:
         raise ValueError("No matrices to aggregate")
@@ -48,9 +54,11 @@ def aggregate_pairwise_matrices(matrices: List[np.ndarray]) -> np.ndarray:
     return np.prod(stacked, axis=0) ** (1.0 / stacked.shape[0])
 
 
+@timed
 def matrix_to_json(matrix: np.ndarray) -> str:
     return json.dumps(matrix.tolist())
 
 
+@timed
 def matrix_from_json(data: str) -> np.ndarray:
     return np.array(json.loads(data), dtype=float)
@@ -0,0 +1,174 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .perf import timed
+from .votes import VoteStore
+
+
+OUTLIER_Z = 3.5
+# Upper bound of the mean RMS distance to the group mean: log-judgements lie in [-log 9, log 9],
+# so reached only by a group split evenly between the two extremes
+MAX_LOG_DISTANCE = float(np.log(9.0))
+CACHE_SIZE = 32
+
+
+@timed
+def stack_log_matrices(matrices: List[np.ndarray]) -> np.ndarray:
+    if not matrices:
+        raise ValueError("No matrices to stack")
+    return np.log(np.stack(matrices, axis=0))
+
+
+@timed
+def group_log_matrix(log_matrices: np.ndarray) -> np.ndarray:
+    # Log of the element-wise geometric mean, as in aggregate_pairwise_matrices
+    return log_matrices.mean(axis=0)
+
+
+@timed
+def voter_distances(log_matrices: np.ndarray, group_log: np.ndarray = None) -> np.ndarray:
+    if group_log is None:
+        group_log = group_log_matrix(log_matrices)
+    n = log_matrices.shape[1]
+    if n < 2:
+        return np.zeros(log_matrices.shape[0])
+    rows, cols = np.triu_indices(n, k=1)
+    diff = log_matrices[:, rows, cols] - group_log[rows, cols]
+    return np.sqrt(np.mean(diff**2, axis=1))
+
+
+@timed
+def consensus_index(distances: np.ndarray) -> float:
+    if distances.size == 0:
+        return 1.0
+    return float(np.clip(1.0 - distances.mean() / MAX_LOG_DISTANCE, 0.0, 1.0))
+
+
+@timed
+def outlier_flags(distances: np.ndarray, threshold: float = OUTLIER_Z) -> np.ndarray:
+    # One-sided modified z-score (median/MAD): only voters far from the group count
+    if distances.size < 3:
+        return np.zeros(distances.shape, dtype=bool)
+    median = np.median(distances)
+    deviation = np.abs(distances - median)
+    mad = np.median(deviation)
+    if mad > 0:
+        return 0.6745 * (distances - median) / mad > threshold
+    # More than half the voters agree exactly: fall back to the mean absolute deviation
+    mean_ad = deviation.mean()
+    if mean_ad == 0:
+        return np.zeros(distances.shape, dtype=bool)
+    return (distances - median) / (1.253314 * mean_ad) > threshold
+
+
+@timed
+def weights_from_log_matrices(log_matrices: np.ndarray) -> np.ndarray:
+    gm = np.exp(log_matrices.mean(axis=2))
+    return gm / gm.sum(axis=1, keepdims=True)
+
+
+@timed
+def cluster_weights(
+    weights: np.ndarray,
+    n_clusters: int = 3,
+    batch_size: int = 1024,
+    n_iter: int = 50,
+    seed: int = 42,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Mini-batch k-means: each step costs O(batch_size * n_clusters), not O(k^2)
+    k = weights.shape[0]
+    n_clusters = min(n_clusters, k)
+    if n_clusters == 0:
+        return np.zeros(0, dtype=int), np.zeros((0, weights.shape[1]))
+    rng = np.random.default_rng(seed)
+    centers = _kmeans_pp_centers(weights, n_clusters, rng, sample_size=batch_size * 16)
+    n_clusters = centers.shape[0]
+    counts = np.zeros(n_clusters)
+    for _ in range(n_iter):
+        batch = weights[rng.integers(0, k, size=min(batch_size, k))]
+        nearest = _nearest_center(batch, centers)
+        for c in range(n_clusters):
+            members = batch[nearest == c]
+            if members.shape[0] == 0:
+                gaps = ((batch - centers[nearest]) ** 2).sum(axis=1)
+                if counts[c] == 0 and gaps.max() > 0:
+                    # Never won a point: move it to the batch point worst served by the other centres
+                    centers[c] = batch[gaps.argmax()]
+                continue
+            counts[c] += members.shape[0]
+            rate = members.shape[0] / counts[c]
+            centers[c] += rate * (members.mean(axis=0) - centers[c])
+    labels = np.concatenate(
+        [_nearest_center(weights[start : start + batch_size * 16], centers) for start in range(0, k, batch_size * 16)]
+    )
+    return labels, centers
+
+
+def _kmeans_pp_centers(weights: np.ndarray, n_clusters: int, rng, sample_size: int) -> np.ndarray:
+    # k-means++ seeding on a sample; duplicates have zero D^2, so votes from the discrete Saaty
+    # scale cannot seed the same centre twice
+    if weights.shape[0] > sample_size:
+        weights = weights[rng.choice(weights.shape[0], size=sample_size, replace=False)]
+    centers = [weights[rng.integers(weights.shape[0])]]
+    gaps = ((weights - centers[0]) ** 2).sum(axis=1)
+    while len(centers) < n_clusters:
+        total = gaps.sum()
+        if total <= 0:
+            # Fewer distinct weight vectors than requested clusters
+            break
+        centers.append(weights[rng.choice(weights.shape[0], p=gaps / total)])
+        gaps = np.minimum(gaps, ((weights - centers[-1]) ** 2).sum(axis=1))
+    return np.array(centers, dtype=float)
+
+
+def _nearest_center(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    dist = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    return dist.argmin(axis=1)
+
+
+@timed
+def consensus_report(log_matrices: np.ndarray, n_clusters: int = 0, weights: np.ndarray = None) -> Dict:
+    group_log = group_log_matrix(log_matrices)
+    distances = voter_distances(log_matrices, group_log)
+    report = {
+        "group_matrix": np.exp(group_log),
+        "distances": distances,
+        "consensus_index": consensus_index(distances),
+        "outliers": outlier_flags(distances),
+    }
+    if n_clusters:
+        if weights is None:
+            weights = weights_from_log_matrices(log_matrices)
+        else:
+            # Stored weights may lack a criterion: derive those rows from the matrices
+            missing = np.isnan(weights).any(axis=1)
+            if missing.any():
+                weights = weights.copy()
+                weights[missing] = weights_from_log_matrices(log_matrices[missing])
+        labels, centers = cluster_weights(weights, n_clusters=n_clusters)
+        report["cluster_labels"] = labels
+        report["cluster_centers"] = centers
+    return report
+
+
+_CACHE: "OrderedDict[Tuple[str, str, int], Dict]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+@timed
+def cached_consensus(dataset_hash: str, store: VoteStore, n_clusters: int = 0) -> Dict:
+    # Keyed by vote version: per-voter results stay aligned with the store's row order
+    key = (dataset_hash, store.version(), n_clusters)
+    with _CACHE_LOCK:
+        if key in _CACHE:
+            _CACHE.move_to_end(key)
+            return _CACHE[key]
+    report = consensus_report(store.log_matrices, n_clusters=n_clusters, weights=store.weights)
+    with _CACHE_LOCK:
+        _CACHE[key] = report
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return report
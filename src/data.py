@@ -1,10 +1,15 @@
 import hashlib
-from typing import List, Tuple
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import Callable, List, Tuple
 
 import os
 import numpy as np
 import pandas as pd
 
+from .perf import timed
+
 
 REQUIRED_COLUMNS = [
     "LOCALI",
@@ -36,6 +41,7 @@ def _fill_missing_ratings(df: pd.DataFrame, seed: int = 42) -> pd.DataFrame:
     return df
 
 
+@timed
 def demo_dataset() -> pd.DataFrame:
     demo_path = os.path.join(os.path.dirname(__file__), "..", "data", "demo_locali.xlsx")
     if os.path.exists(demo_path):
@@ -62,6 +68,7 @@ def demo_dataset() -> pd.DataFrame:
     return pd.DataFrame(data)
 
 
+@timed
 def load_dataframe(file) -> pd.DataFrame:
     name = getattr(file, "name", "")
     if name.lower().endswith(".csv"):
@@ -71,6 +78,7 @@ def load_dataframe(file) -> pd.DataFrame:
     return df
 
 
+@timed
 def validate_schema(df: pd.DataFrame) -> Tuple[bool, List[str]]:
     missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
     if missing:
@@ -78,6 +86,7 @@ def validate_schema(df: pd.DataFrame) -> Tuple[bool, List[str]]:
     return True, []
 
 
+@timed
 def coerce_numeric(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
     for col in REQUIRED_COLUMNS:
@@ -87,6 +96,7 @@ def coerce_numeric(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@timed
 def validate_ranges(df: pd.DataFrame, min_val: float = 1.0, max_val: float = 5.0) -> List[str]:
     issues = []
     for col in REQUIRED_COLUMNS:
@@ -99,9 +109,88 @@ def validate_ranges(df: pd.DataFrame, min_val: float = 1.0, max_val: float = 5.0
     return issues
 
 
+@timed
 def dataset_hash(df: pd.DataFrame) -> str:
     cols = [c for c in REQUIRED_COLUMNS if c in df.columns]
     stable = df[cols].copy()
     stable = stable.sort_values("LOCALI").reset_index(drop=True)
     payload = stable.to_csv(index=False)
     return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+@timed
+def row_fingerprints(df: pd.DataFrame) -> pd.Series:
+    cols = [c for c in REQUIRED_COLUMNS if c in df.columns]
+    return pd.util.hash_pandas_object(df[cols], index=False)
+
+
+@timed
+def group_fingerprints(df: pd.DataFrame) -> pd.Series:
+    # Order-independent per LOCALI, like dataset_hash and the grouped means
+    rows = row_fingerprints(df)
+    return rows.groupby(df["LOCALI"].to_numpy(), dropna=False).agg(
+        lambda values: hashlib.md5(np.sort(values.to_numpy()).tobytes()).hexdigest()
+    )
+
+
+@timed
+def diff_fingerprints(old: pd.Series, new: pd.Series) -> Tuple[List, List]:
+    common = old.reindex(new.index)
+    changed = new.index[common.isna() | (common != new)].tolist()
+    removed = old.index.difference(new.index).tolist()
+    return changed, removed
+
+
+@dataclass(frozen=True, eq=False)
+class SharedDataset:
+    # Read-only: sessions share the same frame and derive new frames from it
+    df: pd.DataFrame
+    hash: str
+    fingerprints: pd.Series
+
+
+# Entries disappear as soon as the last session drops its reference
+_SHARED_BY_SOURCE: "weakref.WeakValueDictionary[str, SharedDataset]" = weakref.WeakValueDictionary()
+_SHARED_BY_HASH: "weakref.WeakValueDictionary[str, SharedDataset]" = weakref.WeakValueDictionary()
+_SHARED_LOCK = threading.Lock()
+
+
+@timed
+def source_key(payload: bytes) -> str:
+    return hashlib.md5(payload).hexdigest()
+
+
+def _freeze(df: pd.DataFrame) -> pd.DataFrame:
+    # Own read-only buffers: an in-place write in one session raises instead of leaking into the others
+    columns = {}
+    for col in df.columns:
+        values = np.array(df[col].to_numpy(), copy=True)
+        values.flags.writeable = False
+        columns[col] = values
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+@timed
+def intern_dataset(key: str, loader: Callable[[], pd.DataFrame]) -> SharedDataset:
+    with _SHARED_LOCK:
+        shared = _SHARED_BY_SOURCE.get(key)
+        if shared is not None:
+            return shared
+    # Parse and hash outside the lock so other sessions are never stuck behind a large upload
+    df = loader()
+    digest = dataset_hash(df)
+    with _SHARED_LOCK:
+        shared = _SHARED_BY_HASH.get(digest)
+    if shared is None:
+        fingerprints = group_fingerprints(df) if validate_schema(df)[0] else pd.Series(dtype=object)
+        candidate = SharedDataset(df=_freeze(df), hash=digest, fingerprints=fingerprints)
+        with _SHARED_LOCK:
+            # Another session may have interned the same content meanwhile: keep the first one
+            shared = _SHARED_BY_HASH.setdefault(digest, candidate)
+    with _SHARED_LOCK:
+        return _SHARED_BY_SOURCE.setdefault(key, shared)
+
+
+@timed
+def shared_dataset_count() -> int:
+    return len(_SHARED_BY_HASH)
@@ -1,11 +1,19 @@
+import asyncio
+import contextvars
 import json
 import os
 import socket
 import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from urllib.parse import urlencode, urlparse, urlunparse, parse_qs
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 from .ahp import matrix_from_json
+from . import perf
+from .perf import timed
+from .votes import VoteStore, VoteStoreBuilder
 
 try:
     import psycopg
@@ -18,6 +26,10 @@ except Exception:
     psycopg2 = None
 
 
+DB_TIMEOUT = float(os.getenv("AHP_DB_TIMEOUT", "10"))
+FETCH_CHUNK = 2000
+
+
 def _get_backend():
     db_url = os.getenv("DATABASE_URL")
     if db_url:
@@ -76,116 +88,316 @@ def _normalize_db_url(db_url: str) -> str:
     return urlunparse(parsed._replace(query=new_query))
 
 
-def get_conn():
+def _connect_sqlite(target: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(target, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    return conn
+
+
+_SCHEMA = {
+    "postgres": """
+        CREATE TABLE IF NOT EXISTS votes (
+            id SERIAL PRIMARY KEY,
+            user_name TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            dataset_hash TEXT NOT NULL,
+            pairwise_matrix_json TEXT NOT NULL,
+            weights_json TEXT NOT NULL,
+            cr DOUBLE PRECISION NOT NULL,
+            UNIQUE(user_name, dataset_hash)
+        );
+        """,
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS votes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_name TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            dataset_hash TEXT NOT NULL,
+            pairwise_matrix_json TEXT NOT NULL,
+            weights_json TEXT NOT NULL,
+            cr REAL NOT NULL,
+            UNIQUE(user_name, dataset_hash)
+        );
+        """,
+}
+
+_SAVE_VOTE = """
+    INSERT INTO votes (user_name, created_at, dataset_hash, pairwise_matrix_json, weights_json, cr)
+    VALUES ({p}, {p}, {p}, {p}, {p}, {p})
+    ON CONFLICT (user_name, dataset_hash) DO UPDATE SET
+        created_at=excluded.created_at,
+        pairwise_matrix_json=excluded.pairwise_matrix_json,
+        weights_json=excluded.weights_json,
+        cr=excluded.cr;
+    """
+
+# Existing votes on the new version win over carried ones
+_CARRY_VOTES = """
+    INSERT INTO votes (user_name, created_at, dataset_hash, pairwise_matrix_json, weights_json, cr)
+    SELECT user_name, created_at, {p}, pairwise_matrix_json, weights_json, cr
+    FROM votes WHERE dataset_hash = {p}
+    ON CONFLICT (user_name, dataset_hash) DO NOTHING;
+    """
+
+_FETCH_VOTES = "SELECT user_name, pairwise_matrix_json, weights_json, cr FROM votes WHERE dataset_hash = {p}"
+
+
+def _sql(template: str, backend: str) -> str:
+    return template.format(p="%s" if backend == "postgres" else "?")
+
+
+class _ThreadedCursor:
+    def __init__(self, conn: "_ThreadedConnection", cursor):
+        self._conn = conn
+        self._cursor = cursor
+        self.rowcount = cursor.rowcount
+
+    async def fetchall(self) -> List[Tuple]:
+        return await self._conn._call(self._cursor.fetchall)
+
+    async def consume(self, builder: VoteStoreBuilder) -> None:
+        # Iterate the DB-API cursor on the connection thread, no intermediate row list
+        await self._conn._call(builder.extend, self._cursor)
+
+
+class _ThreadedConnection:
+    # aiosqlite-style: a blocking DB-API connection confined to one worker thread
+    def __init__(self, executor: ThreadPoolExecutor, conn):
+        self._executor = executor
+        self._conn = conn
+
+    @classmethod
+    async def connect(cls, factory: Callable):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ahp-db")
+        pending = executor.submit(factory)
+        try:
+            conn = await asyncio.wrap_future(pending)
+        except BaseException:
+            # Timed out or cancelled: close the connection whenever it finally opens
+            pending.add_done_callback(_close_abandoned)
+            executor.shutdown(wait=False)
+            raise
+        return cls(executor, conn)
+
+    async def _call(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+
+    async def execute(self, sql: str, params: Tuple = ()) -> _ThreadedCursor:
+        def run():
+            cursor = self._conn.cursor()
+            cursor.execute(sql, params)
+            return cursor
+
+        return _ThreadedCursor(self, await self._call(run))
+
+    async def commit(self) -> None:
+        await self._call(self._conn.commit)
+
+    async def close(self) -> None:
+        # Queued behind any in-flight statement; never block a timed-out caller
+        self._executor.submit(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+
+def _close_abandoned(pending: Future) -> None:
+    if not pending.cancelled() and pending.exception() is None:
+        pending.result().close()
+
+
+async def aget_conn():
     backend, target = _get_backend()
     if backend == "postgres":
         if psycopg is not None:
-            return psycopg.connect(target)
+            return await psycopg.AsyncConnection.connect(target, connect_timeout=max(1, int(DB_TIMEOUT)))
         if psycopg2 is not None:
-            return psycopg2.connect(target)
+            return await _ThreadedConnection.connect(partial(psycopg2.connect, target))
         raise RuntimeError("driver Postgres non installato")
-    conn = sqlite3.connect(target, check_same_thread=False)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    return conn
+    return await _ThreadedConnection.connect(partial(_connect_sqlite, target))
 
 
-def init_db() -> None:
+async def _with_timeout(coro, timeout: Optional[float]):
+    return await asyncio.wait_for(coro, DB_TIMEOUT if timeout is None else timeout)
+
+
+async def _execute(
+    sql: str, params: Tuple = (), fetch: bool = False, builder: Optional[VoteStoreBuilder] = None
+):
+    conn = await aget_conn()
+    try:
+        cur = await conn.execute(sql, params)
+        if builder is not None:
+            if isinstance(cur, _ThreadedCursor):
+                await cur.consume(builder)
+            else:
+                # Async driver cursor: stream in bounded chunks instead of one full row list
+                while True:
+                    rows = await cur.fetchmany(FETCH_CHUNK)
+                    if not rows:
+                        break
+                    builder.extend(rows)
+            return builder.build()
+        if fetch:
+            return await cur.fetchall()
+        await conn.commit()
+        return cur.rowcount
+    finally:
+        await conn.close()
+
+
+@timed
+async def ainit_db(timeout: Optional[float] = None) -> None:
     backend, _ = _get_backend()
-    conn = get_conn()
-    cur = conn.cursor()
-    if backend == "postgres":
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS votes (
-                id SERIAL PRIMARY KEY,
-                user_name TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                dataset_hash TEXT NOT NULL,
-                pairwise_matrix_json TEXT NOT NULL,
-                weights_json TEXT NOT NULL,
-                cr DOUBLE PRECISION NOT NULL,
-                UNIQUE(user_name, dataset_hash)
-            );
-            """
-        )
-    else:
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS votes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_name TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                dataset_hash TEXT NOT NULL,
-                pairwise_matrix_json TEXT NOT NULL,
-                weights_json TEXT NOT NULL,
-                cr REAL NOT NULL,
-                UNIQUE(user_name, dataset_hash)
-            );
-            """
-        )
-    conn.commit()
-    conn.close()
+    await _with_timeout(_execute(_SCHEMA[backend]), timeout)
 
 
-def save_vote(
+@timed
+async def asave_vote(
     user_name: str,
     dataset_hash: str,
     pairwise_matrix_json: str,
     weights_json: str,
     cr: float,
     created_at: str,
+    timeout: Optional[float] = None,
 ) -> None:
     backend, _ = _get_backend()
-    conn = get_conn()
-    cur = conn.cursor()
-    if backend == "postgres":
-        cur.execute(
-            """
-            INSERT INTO votes (user_name, created_at, dataset_hash, pairwise_matrix_json, weights_json, cr)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (user_name, dataset_hash) DO UPDATE SET
-                created_at=EXCLUDED.created_at,
-                pairwise_matrix_json=EXCLUDED.pairwise_matrix_json,
-                weights_json=EXCLUDED.weights_json,
-                cr=EXCLUDED.cr;
-            """,
-            (user_name, created_at, dataset_hash, pairwise_matrix_json, weights_json, cr),
-        )
-    else:
-        cur.execute(
-            """
-            INSERT INTO votes (user_name, created_at, dataset_hash, pairwise_matrix_json, weights_json, cr)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(user_name, dataset_hash) DO UPDATE SET
-                created_at=excluded.created_at,
-                pairwise_matrix_json=excluded.pairwise_matrix_json,
-                weights_json=excluded.weights_json,
-                cr=excluded.cr;
-            """,
-            (user_name, created_at, dataset_hash, pairwise_matrix_json, weights_json, cr),
-        )
-    conn.commit()
-    conn.close()
+    params = (user_name, created_at, dataset_hash, pairwise_matrix_json, weights_json, cr)
+    await _with_timeout(_execute(_sql(_SAVE_VOTE, backend), params), timeout)
 
 
-def fetch_votes(dataset_hash: str) -> List[Tuple]:
-    conn = get_conn()
-    cur = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cur.execute(
-            "SELECT user_name, pairwise_matrix_json, weights_json, cr FROM votes WHERE dataset_hash = ?",
-            (dataset_hash,),
-        )
-    else:
-        cur.execute(
-            "SELECT user_name, pairwise_matrix_json, weights_json, cr FROM votes WHERE dataset_hash = %s",
-            (dataset_hash,),
+@timed
+async def acarry_votes(from_hash: str, to_hash: str, timeout: Optional[float] = None) -> int:
+    backend, _ = _get_backend()
+    return await _with_timeout(_execute(_sql(_CARRY_VOTES, backend), (to_hash, from_hash)), timeout)
+
+
+@timed
+async def afetch_votes(dataset_hash: str, timeout: Optional[float] = None) -> List[Tuple]:
+    backend, _ = _get_backend()
+    rows = await _with_timeout(_execute(_sql(_FETCH_VOTES, backend), (dataset_hash,), fetch=True), timeout)
+    return [tuple(row) for row in rows]
+
+
+@timed
+async def afetch_vote_store(
+    dataset_hash: str, criteria: Sequence[str], timeout: Optional[float] = None
+) -> VoteStore:
+    backend, _ = _get_backend()
+    builder = VoteStoreBuilder(criteria)
+    return await _with_timeout(_execute(_sql(_FETCH_VOTES, backend), (dataset_hash,), builder=builder), timeout)
+
+
+@timed
+async def aprefetch_votes(
+    dataset_hash: str, criteria: Sequence[str], timeout: Optional[float] = None
+) -> VoteStore:
+    # Schema check and vote fetch share the latency budget instead of adding up
+    schema, store = await asyncio.gather(
+        ainit_db(timeout), afetch_vote_store(dataset_hash, criteria, timeout), return_exceptions=True
+    )
+    if isinstance(schema, BaseException):
+        raise schema
+    if isinstance(store, BaseException):
+        if not _is_missing_table(store):
+            raise store
+        # Fresh database: the table did not exist yet when the fetch ran
+        store = await afetch_vote_store(dataset_hash, criteria, timeout)
+    return store
+
+
+def _is_missing_table(exc: BaseException) -> bool:
+    if isinstance(exc, sqlite3.OperationalError):
+        return "no such table" in str(exc)
+    for driver in (psycopg, psycopg2):
+        undefined_table = getattr(getattr(driver, "errors", None), "UndefinedTable", None)
+        if undefined_table is not None and isinstance(exc, undefined_table):
+            return True
+    return False
+
+
+def run_sync(coro):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Called from inside an event loop: run on a private loop in another thread
+    return _PREFETCH_POOL.submit(contextvars.copy_context().run, asyncio.run, coro).result()
+
+
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ahp-prefetch")
+_INFLIGHT: Dict[Tuple[str, Tuple[str, ...]], Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def start_prefetch(dataset_hash: str, criteria: Sequence[str], timeout: Optional[float] = None) -> Future:
+    # One prefetch per dataset at a time: concurrent reruns and sessions share the in-flight future.
+    # Its DB spans are captured on the future and adopted by each session in wait_prefetch().
+    key = (dataset_hash, tuple(criteria))
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        if future is not None and not future.done():
+            return future
+        records: List[Dict] = []
+        context = contextvars.copy_context()
+        future = _PREFETCH_POOL.submit(
+            context.run, perf.run_captured, records, run_sync, aprefetch_votes(dataset_hash, criteria, timeout)
         )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+        future.perf_records = records
+        _INFLIGHT[key] = future
+    future.add_done_callback(partial(_forget_prefetch, key))
+    return future
+
+
+@timed
+def wait_prefetch(future: Future, timeout: Optional[float] = None) -> VoteStore:
+    # Overall deadline: the prefetch may be queued behind other datasets' prefetches
+    try:
+        return future.result(timeout=DB_TIMEOUT if timeout is None else timeout)
+    finally:
+        if future.done():
+            perf.adopt(getattr(future, "perf_records", []))
+
+
+def _forget_prefetch(key: Tuple[str, Tuple[str, ...]], future: Future) -> None:
+    with _INFLIGHT_LOCK:
+        if _INFLIGHT.get(key) is future:
+            del _INFLIGHT[key]
+
+
+@timed
+def init_db(timeout: Optional[float] = None) -> None:
+    run_sync(ainit_db(timeout))
+
+
+@timed
+def save_vote(
+    user_name: str,
+    dataset_hash: str,
+    pairwise_matrix_json: str,
+    weights_json: str,
+    cr: float,
+    created_at: str,
+    timeout: Optional[float] = None,
+) -> None:
+    run_sync(asave_vote(user_name, dataset_hash, pairwise_matrix_json, weights_json, cr, created_at, timeout))
+
+
+@timed
+def carry_votes(from_hash: str, to_hash: str, timeout: Optional[float] = None) -> int:
+    return run_sync(acarry_votes(from_hash, to_hash, timeout))
+
+
+@timed
+def fetch_votes(dataset_hash: str, timeout: Optional[float] = None) -> List[Tuple]:
+    return run_sync(afetch_votes(dataset_hash, timeout))
+
+
+@timed
+def fetch_vote_store(dataset_hash: str, criteria: Sequence[str], timeout: Optional[float] = None) -> VoteStore:
+    return run_sync(afetch_vote_store(dataset_hash, criteria, timeout))
 
 
+@timed
 def parse_vote_matrices(rows: List[Tuple]) -> List:
     matrices = []
     for _, matrix_json, _, _ in rows:
@@ -193,6 +405,7 @@ def parse_vote_matrices(rows: List[Tuple]) -> List:
     return matrices
 
 
+@timed
 def parse_vote_weights(rows: List[Tuple]) -> List[dict]:
     weights = []
     for _, _, weights_json, _ in rows:
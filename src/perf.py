@@ -0,0 +1,242 @@
+import contextvars
+import inspect
+import json
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except Exception:
+    resource = None
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+ENABLED_BY_DEFAULT = os.getenv("AHP_PERF", "") not in ("", "0")
+
+_ENABLED = ENABLED_BY_DEFAULT
+# Context variables rather than thread-locals: they follow work into asyncio tasks and into pool
+# threads submitted through contextvars.copy_context(), so background DB work keeps its session's flag
+# False/True per session, or _CAPTURE_ONLY inside run_captured()
+_RERUN_ENABLED: contextvars.ContextVar[int] = contextvars.ContextVar("ahp_perf_enabled", default=False)
+_RECORDS: contextvars.ContextVar[Optional[List[Dict]]] = contextvars.ContextVar("ahp_perf_records", default=None)
+_DEPTH: contextvars.ContextVar[int] = contextvars.ContextVar("ahp_perf_depth", default=0)
+# Rerun mode for shared background work: record spans for whoever adopts them, skip global counters
+_CAPTURE_ONLY = 2
+_LOCK = threading.Lock()
+_COUNTS: Dict[str, int] = {}
+_ERRORS: Dict[str, int] = {}
+_TOTALS: Dict[str, float] = {}
+_HISTOGRAMS: Dict[str, List[int]] = {}
+
+
+def enable(flag: bool = True) -> None:
+    global _ENABLED
+    _ENABLED = flag
+
+
+def is_enabled() -> bool:
+    return _ENABLED or _RERUN_ENABLED.get()
+
+
+def start_rerun(enabled: bool = False) -> None:
+    # Per session: each Streamlit session reruns its script on its own thread
+    _RERUN_ENABLED.set(enabled)
+    _RECORDS.set([])
+    _DEPTH.set(0)
+
+
+def rerun_records() -> List[Dict]:
+    return list(_RECORDS.get() or [])
+
+
+def run_captured(records: List[Dict], fn: Callable, *args, **kwargs) -> Any:
+    # Call inside a copied context (contextvars.copy_context().run): fn's spans go to `records`
+    # whatever the caller's debug flag, so any session that later waits on the work can adopt them
+    _RECORDS.set(records)
+    _DEPTH.set(0)
+    if not _RERUN_ENABLED.get():
+        _RERUN_ENABLED.set(_CAPTURE_ONLY)
+    return fn(*args, **kwargs)
+
+
+def adopt(records: List[Dict]) -> None:
+    # Nest spans captured elsewhere under the current span of this rerun
+    own = _RECORDS.get()
+    if own is None or not is_enabled():
+        return
+    depth = _DEPTH.get()
+    own.extend({**record, "depth": record["depth"] + depth} for record in list(records))
+
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def _peak_rss_bytes() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, KiB elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _current_rss_bytes() -> Optional[int]:
+    # Linux only; elsewhere spans carry no memory delta and only the process peak is exported
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_memory() -> Dict[str, Optional[int]]:
+    return {"rss_bytes": _current_rss_bytes(), "peak_rss_bytes": _peak_rss_bytes()}
+
+
+def _record(name: str, elapsed: float, failed: bool) -> None:
+    with _LOCK:
+        _COUNTS[name] = _COUNTS.get(name, 0) + 1
+        _TOTALS[name] = _TOTALS.get(name, 0.0) + elapsed
+        if failed:
+            _ERRORS[name] = _ERRORS.get(name, 0) + 1
+        hist = _HISTOGRAMS.setdefault(name, [0] * len(LATENCY_BUCKETS))
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                hist[i] += 1
+                break
+
+
+@contextmanager
+def span(name: str):
+    if not (_ENABLED or _RERUN_ENABLED.get()):
+        yield
+        return
+    depth = _DEPTH.get()
+    token = _DEPTH.set(depth + 1)
+    # Reserve the rerun slot now so the breakdown lists parents before their children
+    entry = None
+    records = _RECORDS.get()
+    if records is not None:
+        entry = {"span": name, "seconds": None, "depth": depth, "error": False, "rss_delta_bytes": None}
+        records.append(entry)
+    # RSS is process-wide: under concurrent sessions the delta includes their allocations too
+    rss_start = _current_rss_bytes()
+    failed = False
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        # Only real failures: Streamlit's rerun/stop exceptions derive from BaseException
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _DEPTH.reset(token)
+        if _ENABLED or _RERUN_ENABLED.get() != _CAPTURE_ONLY:
+            _record(name, elapsed, failed)
+        if entry is not None:
+            rss_end = _current_rss_bytes()
+            entry["seconds"] = elapsed
+            entry["error"] = failed
+            if rss_start is not None and rss_end is not None:
+                entry["rss_delta_bytes"] = rss_end - rss_start
+
+
+def timed(fn: Callable) -> Callable:
+    name = f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__qualname__}"
+
+    if inspect.iscoroutinefunction(fn):
+
+        @wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            if not (_ENABLED or _RERUN_ENABLED.get()):
+                return await fn(*args, **kwargs)
+            with span(name):
+                return await fn(*args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not (_ENABLED or _RERUN_ENABLED.get()):
+            return fn(*args, **kwargs)
+        with span(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def snapshot() -> Dict[str, Dict]:
+    with _LOCK:
+        return {
+            name: {
+                "count": _COUNTS[name],
+                "errors": _ERRORS.get(name, 0),
+                "total_seconds": _TOTALS[name],
+                "buckets": list(_HISTOGRAMS[name]),
+            }
+            for name in sorted(_COUNTS)
+        }
+
+
+def reset() -> None:
+    with _LOCK:
+        _COUNTS.clear()
+        _ERRORS.clear()
+        _TOTALS.clear()
+        _HISTOGRAMS.clear()
+
+
+def export_jsonl() -> str:
+    lines = []
+    for name, stats in snapshot().items():
+        buckets = {str(bound): count for bound, count in zip(LATENCY_BUCKETS, stats["buckets"])}
+        lines.append(json.dumps({"span": name, **stats, "buckets": buckets}))
+    lines.append(json.dumps({"process": process_memory()}))
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def export_prometheus() -> str:
+    stats = snapshot()
+    lines = [
+        "# HELP ahp_span_seconds Latency of instrumented spans.",
+        "# TYPE ahp_span_seconds histogram",
+    ]
+    for name, s in stats.items():
+        label = _label(name)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, s["buckets"]):
+            cumulative += count
+            le = "+Inf" if math.isinf(bound) else repr(bound)
+            lines.append(f'ahp_span_seconds_bucket{{span="{label}",le="{le}"}} {cumulative}')
+        lines.append(f'ahp_span_seconds_sum{{span="{label}"}} {s["total_seconds"]!r}')
+        lines.append(f'ahp_span_seconds_count{{span="{label}"}} {s["count"]}')
+    lines += ["# HELP ahp_span_errors_total Spans that raised.", "# TYPE ahp_span_errors_total counter"]
+    for name, s in stats.items():
+        lines.append(f'ahp_span_errors_total{{span="{_label(name)}"}} {s["errors"]}')
+    memory = process_memory()
+    lines += [
+        "# HELP ahp_process_peak_rss_bytes Lifetime peak resident set size of the process.",
+        "# TYPE ahp_process_peak_rss_bytes gauge",
+        f"ahp_process_peak_rss_bytes {memory['peak_rss_bytes']}",
+    ]
+    if memory["rss_bytes"] is not None:
+        lines += [
+            "# HELP ahp_process_rss_bytes Current resident set size of the process.",
+            "# TYPE ahp_process_rss_bytes gauge",
+            f"ahp_process_rss_bytes {memory['rss_bytes']}",
+        ]
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,10 @@
-from typing import Dict
+from typing import Dict, List, Optional
 
 import numpy as np
 import pandas as pd
 
+from .perf import timed
+
 MACRO_CRITERIA = ["Comodità", "Cibo e bevande", "Rapporto qualità/prezzo"]
 
 MACRO_MAP = {
@@ -18,6 +20,7 @@ def _mean_ignore_nan(values: pd.Series) -> float:
     return float(values.mean(skipna=True))
 
 
+@timed
 def compute_macro_scores(df: pd.DataFrame) -> pd.DataFrame:
     grouped = df.groupby("LOCALI", dropna=False).mean(numeric_only=True)
     macro_scores = pd.DataFrame(index=grouped.index)
@@ -27,14 +30,57 @@ def compute_macro_scores(df: pd.DataFrame) -> pd.DataFrame:
     return macro_scores
 
 
-def normalize_min_max(df: pd.DataFrame) -> pd.DataFrame:
+@timed
+def update_macro_scores(macro_scores: pd.DataFrame, df: pd.DataFrame, changed: List, removed: List) -> pd.DataFrame:
+    # Recompute only the LOCALI groups whose fingerprint changed
+    stale = macro_scores.index.isin(list(changed) + list(removed))
+    kept = macro_scores[~stale]
+    subset = df[df["LOCALI"].isin(changed)]
+    if subset.empty:
+        return kept
+    updated = compute_macro_scores(subset)
+    return pd.concat([kept, updated]).sort_index()
+
+
+@timed
+def min_max_bounds(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({"min": df.min(skipna=True), "max": df.max(skipna=True)})
+
+
+@timed
+def update_min_max_bounds(
+    bounds: pd.DataFrame, old_rows: pd.DataFrame, new_rows: pd.DataFrame, full: pd.DataFrame
+) -> pd.DataFrame:
+    # Widen with the new rows; rescan a column only if a dropped row held its bound
+    bounds = bounds.copy()
+    for col in full.columns:
+        new_series = new_rows[col].dropna() if col in new_rows.columns else pd.Series(dtype=float)
+        old_series = old_rows[col].dropna() if col in old_rows.columns else pd.Series(dtype=float)
+        if col not in bounds.index or bounds.loc[col].isna().any():
+            bounds.loc[col] = [full[col].min(skipna=True), full[col].max(skipna=True)]
+            continue
+        min_v, max_v = bounds.loc[col, "min"], bounds.loc[col, "max"]
+        if not old_series.empty and ((old_series <= min_v).any() or (old_series >= max_v).any()):
+            bounds.loc[col] = [full[col].min(skipna=True), full[col].max(skipna=True)]
+            continue
+        if not new_series.empty:
+            bounds.loc[col] = [min(min_v, new_series.min()), max(max_v, new_series.max())]
+    return bounds.loc[list(full.columns)]
+
+
+@timed
+def normalize_min_max(df: pd.DataFrame, bounds: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     normed = df.copy()
     for col in normed.columns:
         series = normed[col]
         if series.dropna().empty:
             continue
-        min_v = series.min(skipna=True)
-        max_v = series.max(skipna=True)
+        if bounds is not None and col in bounds.index:
+            min_v = bounds.loc[col, "min"]
+            max_v = bounds.loc[col, "max"]
+        else:
+            min_v = series.min(skipna=True)
+            max_v = series.max(skipna=True)
         if min_v == max_v:
             normed[col] = 0.5
         else:
@@ -42,10 +88,17 @@ def normalize_min_max(df: pd.DataFrame) -> pd.DataFrame:
     return normed
 
 
-def rank_alternatives(df: pd.DataFrame, weights: Dict[str, float]) -> pd.DataFrame:
-    macro_scores = compute_macro_scores(df)
+@timed
+def rank_alternatives(
+    df: pd.DataFrame,
+    weights: Dict[str, float],
+    macro_scores: Optional[pd.DataFrame] = None,
+    bounds: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    if macro_scores is None:
+        macro_scores = compute_macro_scores(df)
     macro_scores = macro_scores[MACRO_CRITERIA]
-    normed = normalize_min_max(macro_scores)
+    normed = normalize_min_max(macro_scores, bounds)
 
     # Exclude rows with any NaN macro score
     valid = normed.dropna(axis=0, how="any")
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import sys
+from dataclasses import dataclass
+from typing import Iterable, Sequence, Tuple
+
+import numpy as np
+
+from .perf import timed
+
+
+@dataclass(frozen=True, eq=False)
+class VoteStore:
+    # One row per voter, aligned across every column
+    criteria: Tuple[str, ...]
+    users: np.ndarray
+    log_matrices: np.ndarray
+    weights: np.ndarray
+    cr: np.ndarray
+
+    def __len__(self) -> int:
+        return self.users.shape[0]
+
+    def __getitem__(self, voters) -> "VoteStore":
+        # Slices are zero-copy views; masks and index arrays copy only the selected voters
+        if isinstance(voters, (int, np.integer)):
+            voters = slice(voters, voters + 1 if voters != -1 else None)
+        return VoteStore(
+            criteria=self.criteria,
+            users=self.users[voters],
+            log_matrices=self.log_matrices[voters],
+            weights=self.weights[voters],
+            cr=self.cr[voters],
+        )
+
+    @property
+    def nbytes(self) -> int:
+        names = sum(sys.getsizeof(name) for name in set(self.users.tolist()))
+        return int(self.users.nbytes + names + self.log_matrices.nbytes + self.weights.nbytes + self.cr.nbytes)
+
+    def matrices(self) -> np.ndarray:
+        return np.exp(self.log_matrices)
+
+    def group_matrix(self) -> np.ndarray:
+        if len(self) == 0:
+            raise ValueError("No matrices to aggregate")
+        # Element-wise geometric mean, as in aggregate_pairwise_matrices
+        return np.exp(self.log_matrices.mean(axis=0))
+
+    def version(self) -> str:
+        digest = hashlib.md5()
+        digest.update("\0".join(self.users.tolist()).encode("utf-8"))
+        digest.update(np.ascontiguousarray(self.log_matrices).tobytes())
+        return digest.hexdigest()
+
+
+class VoteStoreBuilder:
+    # Appends (user_name, matrix_json, weights_json, cr) rows, e.g. straight off a cursor or in
+    # fetchmany() chunks, into preallocated columns that grow by doubling
+    def __init__(self, criteria: Sequence[str], capacity: int = 256):
+        n = len(criteria)
+        capacity = max(capacity, 1)
+        self.criteria = tuple(criteria)
+        self._size = 0
+        self._users = np.empty(capacity, dtype=object)
+        self._matrices = np.empty((capacity, n, n))
+        self._weights = np.empty((capacity, n))
+        self._cr = np.empty(capacity)
+
+    def _grow(self) -> None:
+        capacity = self._users.shape[0] * 2
+        n = len(self.criteria)
+        self._users = np.resize(self._users, capacity)
+        self._matrices = np.resize(self._matrices, (capacity, n, n))
+        self._weights = np.resize(self._weights, (capacity, n))
+        self._cr = np.resize(self._cr, capacity)
+
+    def extend(self, rows: Iterable[Tuple]) -> None:
+        k = self._size
+        for user_name, matrix_json, weights_json, row_cr in rows:
+            if k == self._users.shape[0]:
+                self._grow()
+            self._users[k] = sys.intern(user_name)
+            self._matrices[k] = json.loads(matrix_json)
+            parsed = json.loads(weights_json)
+            self._weights[k] = [parsed.get(c, np.nan) for c in self.criteria]
+            self._cr[k] = row_cr
+            k += 1
+            self._size = k
+
+    def build(self) -> VoteStore:
+        k = self._size
+        log_matrices = self._matrices[:k].copy()
+        np.log(log_matrices, out=log_matrices)
+        columns = [self._users[:k].copy(), log_matrices, self._weights[:k].copy(), self._cr[:k].copy()]
+        # Read-only, like shared datasets: a prefetched store is handed to every waiting session
+        for column in columns:
+            column.flags.writeable = False
+        users, log_matrices, weights, cr = columns
+        return VoteStore(criteria=self.criteria, users=users, log_matrices=log_matrices, weights=weights, cr=cr)
+
+
+@timed
+def store_from_rows(rows: Iterable[Tuple], criteria: Sequence[str], capacity: int = 256) -> VoteStore:
+    builder = VoteStoreBuilder(criteria, capacity)
+    builder.extend(rows)
+    return builder.build()
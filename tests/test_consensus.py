@@ -0,0 +1,75 @@
+import numpy as np
+
+from src.ahp import aggregate_pairwise_matrices, matrix_to_json
+from src.consensus import cached_consensus, cluster_weights, consensus_report, stack_log_matrices
+from src.votes import store_from_rows
+
+
+def _matrix(a, b, c):
+    return np.array([[1, a, b], [1 / a, 1, c], [1 / b, 1 / c, 1]], dtype=float)
+
+
+def test_consensus_report_flags_outlier():
+    matrices = [_matrix(3, 5, 3)] * 4 + [_matrix(5, 5, 3), _matrix(1 / 9, 1 / 9, 1 / 9)]
+    report = consensus_report(stack_log_matrices(matrices))
+    assert np.allclose(report["group_matrix"], aggregate_pairwise_matrices(matrices))
+    assert 0 <= report["consensus_index"] <= 1
+    assert report["outliers"].tolist() == [False] * 5 + [True]
+    assert report["distances"].argmax() == 5
+
+
+def test_identical_votes_full_consensus():
+    report = consensus_report(stack_log_matrices([_matrix(3, 5, 3)] * 3))
+    assert np.isclose(report["consensus_index"], 1.0)
+    assert not report["outliers"].any()
+
+
+def test_polarised_group_has_no_consensus():
+    matrices = [_matrix(9, 9, 9)] * 50 + [_matrix(1 / 9, 1 / 9, 1 / 9)] * 50
+    report = consensus_report(stack_log_matrices(matrices))
+    assert np.isclose(report["consensus_index"], 0.0)
+
+
+def test_cluster_weights_separates_groups():
+    weights = np.array([[0.7, 0.2, 0.1]] * 50 + [[0.1, 0.2, 0.7]] * 50)
+    labels, centers = cluster_weights(weights, n_clusters=2)
+    assert len(set(labels[:50])) == 1
+    assert len(set(labels[50:])) == 1
+    assert labels[0] != labels[-1]
+    assert centers.shape == (2, 3)
+
+
+def test_cluster_weights_identical_votes_any_seed():
+    sizes = [700, 200, 100]
+    weights = np.repeat(np.array([[0.7, 0.2, 0.1], [0.1, 0.2, 0.7], [0.2, 0.6, 0.2]]), sizes, axis=0)
+    for seed in range(50):
+        labels, _ = cluster_weights(weights, n_clusters=3, seed=seed)
+        groups = np.split(labels, np.cumsum(sizes)[:-1])
+        assert all(len(set(group)) == 1 for group in groups)
+        assert len({group[0] for group in groups}) == 3
+
+
+def test_cluster_weights_fewer_distinct_votes_than_clusters():
+    labels, centers = cluster_weights(np.array([[0.5, 0.3, 0.2]] * 10), n_clusters=3)
+    assert centers.shape == (1, 3)
+    assert set(labels) == {0}
+
+
+def test_cached_consensus_keyed_by_vote_version():
+    criteria = ["A", "B", "C"]
+    rows = [("a", matrix_to_json(_matrix(3, 5, 3)), "{}", 0.0), ("b", matrix_to_json(_matrix(1, 3, 3)), "{}", 0.0)]
+    first = cached_consensus("hash", store_from_rows(rows, criteria))
+    assert cached_consensus("hash", store_from_rows(list(rows), criteria)) is first
+    changed = store_from_rows([rows[0], ("b", matrix_to_json(_matrix(5, 5, 1)), "{}", 0.0)], criteria)
+    assert cached_consensus("hash", changed) is not first
+
+
+def test_clustering_ignores_missing_stored_weights():
+    criteria = ["A", "B", "C"]
+    rows = [(f"u{i}", matrix_to_json(_matrix(9, 9, 3)), "{}", 0.0) for i in range(5)]
+    rows += [(f"v{i}", matrix_to_json(_matrix(1 / 9, 1 / 9, 1 / 3)), "{}", 0.0) for i in range(5)]
+    report = cached_consensus("nan-weights", store_from_rows(rows, criteria), n_clusters=2)
+    assert not np.isnan(report["cluster_centers"]).any()
+    labels = report["cluster_labels"]
+    assert len(set(labels[:5])) == 1 and len(set(labels[5:])) == 1
+    assert labels[0] != labels[-1]
@@ -1,6 +1,24 @@
+import gc
+import threading
+import time
+
 import pandas as pd
+import pytest
 
-from src.data import REQUIRED_COLUMNS, coerce_numeric, dataset_hash, demo_dataset, load_dataframe, validate_ranges, validate_schema
+from src.data import (
+    REQUIRED_COLUMNS,
+    coerce_numeric,
+    dataset_hash,
+    demo_dataset,
+    diff_fingerprints,
+    group_fingerprints,
+    intern_dataset,
+    load_dataframe,
+    shared_dataset_count,
+    source_key,
+    validate_ranges,
+    validate_schema,
+)
 
 
 def test_demo_dataset_schema():
@@ -32,3 +50,68 @@ def test_load_excel(tmp_path):
         loaded = load_dataframe(f)
     ok, _ = validate_schema(loaded)
     assert ok
+
+
+def test_group_fingerprints_diff():
+    df = demo_dataset()
+    old = group_fingerprints(df)
+    edited = df.copy()
+    first = edited.loc[0, "LOCALI"]
+    last = edited.loc[1, "LOCALI"]
+    edited.loc[0, "Vino"] = 1 if edited.loc[0, "Vino"] != 1 else 2
+    edited = edited.drop(index=1)
+    changed, removed = diff_fingerprints(old, group_fingerprints(edited))
+    assert changed == [first]
+    assert removed == [last]
+    assert diff_fingerprints(old, group_fingerprints(df.iloc[::-1])) == ([], [])
+
+
+def test_intern_dataset_shared_and_evicted():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return demo_dataset()
+
+    before = shared_dataset_count()
+    first = intern_dataset(source_key(b"upload-a"), loader)
+    second = intern_dataset(source_key(b"upload-a"), loader)
+    other_source = intern_dataset(source_key(b"upload-b"), loader)
+    assert first is second
+    assert other_source is first
+    assert len(calls) == 2
+    assert first.hash == dataset_hash(first.df)
+    assert shared_dataset_count() == before + 1
+
+    del first, second, other_source
+    gc.collect()
+    assert shared_dataset_count() == before
+
+
+def test_shared_dataset_is_read_only():
+    shared = intern_dataset(source_key(b"read-only"), demo_dataset)
+    before = shared.df["Vino"].tolist()
+    with pytest.raises(ValueError):
+        shared.df.loc[shared.df.index[0], "Vino"] = 1
+    assert shared.df["Vino"].tolist() == before
+    edited = shared.df.copy()
+    edited.loc[edited.index[0], "Vino"] = 1
+    assert shared.df["Vino"].tolist() == before
+
+
+def test_slow_loader_does_not_block_other_keys():
+    warm = intern_dataset(source_key(b"warm"), demo_dataset)
+    started = threading.Event()
+
+    def slow_loader():
+        started.set()
+        time.sleep(0.5)
+        return demo_dataset().head(5)
+
+    worker = threading.Thread(target=intern_dataset, args=(source_key(b"slow"), slow_loader))
+    worker.start()
+    started.wait()
+    start = time.perf_counter()
+    assert intern_dataset(source_key(b"warm"), demo_dataset) is warm
+    assert time.perf_counter() - start < 0.1
+    worker.join()
@@ -0,0 +1,169 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from src import db, perf
+
+
+@pytest.fixture(autouse=True)
+def drain_prefetches(monkeypatch):
+    # Depends on monkeypatch so it tears down first: leftover prefetches finish while this
+    # test's DB path and patches are still in place
+    yield
+    with db._INFLIGHT_LOCK:
+        pending = list(db._INFLIGHT.values())
+    for future in pending:
+        try:
+            future.result(timeout=5)
+        except Exception:
+            pass
+    with db._INFLIGHT_LOCK:
+        db._INFLIGHT.clear()
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setenv("AHP_DB_PATH", str(tmp_path / "ahp.db"))
+
+
+@pytest.fixture
+def slow_db(sqlite_db, monkeypatch):
+    # Stand-in for a cold serverless Postgres: every connect stalls
+    def slow_connect(target):
+        time.sleep(0.5)
+        return sqlite3.connect(target, check_same_thread=False)
+
+    monkeypatch.setattr(db, "_connect_sqlite", slow_connect)
+
+
+def test_sync_facade_roundtrip(sqlite_db):
+    db.init_db()
+    db.save_vote("anna", "h1", "[[1]]", "{}", 0.0, "t1")
+    db.save_vote("anna", "h1", "[[2]]", "{}", 0.1, "t2")
+    db.save_vote("bruno", "h1", "[[1]]", "{}", 0.0, "t1")
+    db.save_vote("anna", "h2", "[[3]]", "{}", 0.0, "t3")
+    assert sorted(db.fetch_votes("h1")) == [("anna", "[[2]]", "{}", 0.1), ("bruno", "[[1]]", "{}", 0.0)]
+
+    assert db.carry_votes("h1", "h2") == 1
+    assert sorted(db.fetch_votes("h2")) == [("anna", "[[3]]", "{}", 0.0), ("bruno", "[[1]]", "{}", 0.0)]
+
+    store = db.fetch_vote_store("h2", ["A"])
+    assert sorted(store.users.tolist()) == ["anna", "bruno"]
+    assert store.log_matrices.shape == (2, 1, 1)
+
+
+def test_prefetch_on_fresh_database(sqlite_db):
+    assert len(db.start_prefetch("h1", ["A"]).result(timeout=5)) == 0
+
+
+def test_timeout_on_slow_connect(slow_db):
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        db.fetch_votes("h1", timeout=0.1)
+    assert time.perf_counter() - start < 0.4
+
+
+def test_prefetch_does_not_block_caller(slow_db):
+    db.init_db(timeout=5)
+    start = time.perf_counter()
+    future = db.start_prefetch("h1", ["A"], timeout=5)
+    assert time.perf_counter() - start < 0.1
+    assert len(future.result(timeout=5)) == 0
+    # Schema check and fetch ran concurrently, not one after the other
+    assert time.perf_counter() - start < 0.9
+
+
+def test_prefetch_shared_while_in_flight(slow_db):
+    db.init_db(timeout=5)
+    first = db.start_prefetch("h1", ["A"], timeout=5)
+    assert db.start_prefetch("h1", ["A"], timeout=5) is first
+    other = db.start_prefetch("h2", ["A"], timeout=5)
+    assert other is not first
+    first.result(timeout=5)
+    again = db.start_prefetch("h1", ["A"], timeout=5)
+    assert again is not first
+    again.result(timeout=5)
+    other.result(timeout=5)
+
+
+def test_prefetch_retries_only_missing_table(sqlite_db, monkeypatch):
+    db.init_db()
+    calls = []
+
+    async def failing_fetch(dataset_hash, criteria, timeout=None):
+        calls.append(dataset_hash)
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(db, "afetch_vote_store", failing_fetch)
+    with pytest.raises(asyncio.TimeoutError):
+        db.run_sync(db.aprefetch_votes("h1", ["A"]))
+    assert calls == ["h1"]
+
+
+def test_prefetch_spans_reach_session_rerun(sqlite_db):
+    perf.start_rerun(enabled=True)
+    try:
+        with perf.span("app.results_section"):
+            db.wait_prefetch(db.start_prefetch("h-perf", ["A"]), timeout=5)
+        records = perf.rerun_records()
+    finally:
+        perf.start_rerun()
+    depths = {record["span"]: record["depth"] for record in records}
+    assert depths["db.aprefetch_votes"] == 2
+    assert depths["db.afetch_vote_store"] == 3
+    assert "db.ainit_db" in depths
+
+
+def test_shared_prefetch_spans_reach_waiting_session(slow_db):
+    db.init_db(timeout=5)
+    perf.enable(False)
+    perf.reset()
+    # Started by a session with the panel off...
+    perf.start_rerun()
+    future = db.start_prefetch("h-shared", ["A"], timeout=5)
+    # ...and joined by one with the panel on
+    perf.start_rerun(enabled=True)
+    try:
+        assert db.start_prefetch("h-shared", ["A"], timeout=5) is future
+        store = db.wait_prefetch(future, timeout=5)
+        names = [record["span"] for record in perf.rerun_records()]
+        counted = perf.snapshot()
+    finally:
+        perf.start_rerun()
+        perf.enable(perf.ENABLED_BY_DEFAULT)
+        perf.reset()
+    assert "db.afetch_vote_store" in names
+    assert "db.afetch_vote_store" not in counted
+    assert not store.log_matrices.flags.writeable
+
+
+def test_async_cursor_streamed_in_chunks(monkeypatch):
+    rows = [(f"u{i}", "[[1.0]]", '{"A": 1.0}', 0.0) for i in range(5)]
+    chunks = []
+
+    class FakeCursor:
+        rowcount = -1
+
+        async def fetchmany(self, size):
+            chunk = rows[len(chunks) * size : (len(chunks) + 1) * size]
+            chunks.append(len(chunk))
+            return chunk
+
+    class FakeAsyncConnection:
+        async def execute(self, sql, params):
+            return FakeCursor()
+
+        async def close(self):
+            pass
+
+    async def fake_conn():
+        return FakeAsyncConnection()
+
+    monkeypatch.setattr(db, "aget_conn", fake_conn)
+    monkeypatch.setattr(db, "FETCH_CHUNK", 2)
+    store = db.run_sync(db.afetch_vote_store("h1", ["A"]))
+    assert store.users.tolist() == [row[0] for row in rows]
+    assert chunks == [2, 2, 1, 0]
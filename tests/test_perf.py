@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from src import perf
+from src.ahp import weights_geometric_mean
+from src.data import demo_dataset
+from src.scoring import compute_macro_scores
+
+
+@pytest.fixture(autouse=True)
+def clean_perf():
+    perf.reset()
+    perf.start_rerun()
+    yield
+    perf.enable(perf.ENABLED_BY_DEFAULT)
+    perf.start_rerun()
+    perf.reset()
+
+
+def test_disabled_records_nothing():
+    perf.enable(False)
+    compute_macro_scores(demo_dataset())
+    assert perf.snapshot() == {}
+    assert perf.rerun_records() == []
+
+
+def test_rerun_breakdown_and_counters():
+    perf.enable(False)
+    perf.start_rerun(enabled=True)
+    with perf.span("app.results_section"):
+        compute_macro_scores(demo_dataset())
+    records = perf.rerun_records()
+    # Start order: every parent is listed before its children
+    assert [(r["span"], r["depth"]) for r in records] == [
+        ("app.results_section", 0),
+        ("data.demo_dataset", 1),
+        ("data.coerce_numeric", 2),
+        ("scoring.compute_macro_scores", 1),
+    ]
+    assert all(r["seconds"] is not None for r in records)
+    assert records[0]["seconds"] >= records[1]["seconds"] + records[3]["seconds"]
+
+    stats = perf.snapshot()["scoring.compute_macro_scores"]
+    assert stats["count"] == 1
+    assert sum(stats["buckets"]) == 1
+    assert stats["errors"] == 0
+
+
+def test_errors_counted_and_reraised():
+    perf.enable(True)
+    with pytest.raises(ValueError):
+        weights_geometric_mean(np.ones((2, 3)))
+    assert perf.snapshot()["ahp.weights_geometric_mean"]["errors"] == 1
+
+
+def test_control_flow_exceptions_are_not_errors():
+    class RerunException(BaseException):
+        pass
+
+    perf.enable(True)
+    with pytest.raises(RerunException):
+        with perf.span("app.results_section"):
+            raise RerunException()
+    stats = perf.snapshot()["app.results_section"]
+    assert stats["count"] == 1
+    assert stats["errors"] == 0
+
+
+def test_exports():
+    perf.enable(True)
+    with perf.span("app.vote_section"):
+        pass
+    jsonl = perf.export_jsonl().strip().splitlines()
+    assert len(jsonl) == 2
+    assert '"span": "app.vote_section"' in jsonl[0]
+    assert '"process"' in jsonl[1]
+    prom = perf.export_prometheus()
+    assert 'ahp_span_seconds_bucket{span="app.vote_section",le="+Inf"} 1' in prom
+    assert 'ahp_span_seconds_count{span="app.vote_section"} 1' in prom
+    assert "# TYPE ahp_process_peak_rss_bytes gauge" in prom
+    assert "ahp_span_peak_rss_bytes" not in prom
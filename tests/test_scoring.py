@@ -1,5 +1,13 @@
-from src.data import demo_dataset
-from src.scoring import compute_macro_scores, rank_alternatives
+import pandas as pd
+
+from src.data import demo_dataset, diff_fingerprints, group_fingerprints
+from src.scoring import (
+    compute_macro_scores,
+    min_max_bounds,
+    rank_alternatives,
+    update_macro_scores,
+    update_min_max_bounds,
+)
 
 
 def test_compute_macro_scores():
@@ -16,3 +24,25 @@ def test_rank_alternatives():
     assert not ranking.empty
     assert list(ranking.columns) == ["LOCALI", "score"]
     assert ranking.iloc[0]["score"] >= ranking.iloc[-1]["score"]
+
+
+def test_update_macro_scores_matches_full_recompute():
+    df = demo_dataset()
+    macro = compute_macro_scores(df)
+    bounds = min_max_bounds(macro)
+    edited = df.iloc[2:].copy()
+    edited.loc[edited.index[0], "Birra"] = 1
+    edited = pd.concat([edited, df.iloc[[5]].assign(LOCALI="Nuovo locale", Veg=5)])
+    changed, removed = diff_fingerprints(group_fingerprints(df), group_fingerprints(edited))
+
+    updated = update_macro_scores(macro, edited, changed, removed)
+    full = compute_macro_scores(edited)
+    pd.testing.assert_frame_equal(updated, full)
+
+    new_bounds = update_min_max_bounds(
+        bounds,
+        macro[macro.index.isin(changed + removed)],
+        updated[updated.index.isin(changed)],
+        updated,
+    )
+    pd.testing.assert_frame_equal(new_bounds, min_max_bounds(full))
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+
+from src.ahp import aggregate_pairwise_matrices, matrix_to_json, weights_geometric_mean
+from src.db import parse_vote_matrices
+from src.votes import store_from_rows
+
+CRITERIA = ["A", "B", "C"]
+
+
+def _rows(k):
+    rng = np.random.default_rng(0)
+    scale = np.array([1 / 9, 1 / 5, 1 / 3, 1, 3, 5, 9])
+    rows = []
+    for i in range(k):
+        a, b, c = rng.choice(scale, size=3)
+        mat = np.array([[1, a, b], [1 / a, 1, c], [1 / b, 1 / c, 1]])
+        weights = weights_geometric_mean(mat)
+        rows.append((f"user{i}", matrix_to_json(mat), json.dumps(dict(zip(CRITERIA, weights.tolist()))), 0.01 * i))
+    return rows
+
+
+def test_store_from_rows_columns():
+    rows = _rows(300)
+    store = store_from_rows(iter(rows), CRITERIA, capacity=4)
+    assert len(store) == 300
+    assert store.log_matrices.shape == (300, 3, 3)
+    assert np.allclose(store.matrices(), np.stack(parse_vote_matrices(rows)))
+    assert np.allclose(store.group_matrix(), aggregate_pairwise_matrices(parse_vote_matrices(rows)))
+    assert np.allclose(store.weights.sum(axis=1), 1.0)
+    assert np.allclose(store.cr, [row[3] for row in rows])
+    assert store.users[7] == "user7"
+    assert store.nbytes >= store.log_matrices.nbytes + store.weights.nbytes
+
+
+def test_slicing_is_zero_copy():
+    store = store_from_rows(_rows(20), CRITERIA)
+    head = store[:5]
+    assert len(head) == 5
+    assert np.shares_memory(head.log_matrices, store.log_matrices)
+    assert np.shares_memory(head.weights, store.weights)
+    picked = store[store.cr > 0.1]
+    assert picked.users.tolist() == [f"user{i}" for i in range(11, 20)]
+    assert len(store[-1]) == 1
+
+
+def test_store_is_read_only():
+    store = store_from_rows(_rows(5), CRITERIA)
+    for column in (store.users, store.log_matrices, store.weights, store.cr, store[:2].weights):
+        assert not column.flags.writeable
+
+
+def test_empty_store():
+    store = store_from_rows([], CRITERIA)
+    assert len(store) == 0
+    assert store.log_matrices.shape == (0, 3, 3)